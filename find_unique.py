@@ -1,12 +1,287 @@
 import polars as pl
-import itertools
-from typing import List, Tuple, Dict
+import numpy as np
+import bisect
+import csv
+import functools
+import heapq
+import logging
+import numba
+import operator
+from numba import njit, prange
+from typing import List, Tuple, Dict, Iterator
 import os
+import math
 import time
-import ast # Used for safely parsing string representations of lists
 
-# New, robust log format:
-# CACHE_ENTRY | DATASET: dataset_name | COLUMNS: ['col_a', 'col_b'] | UNIQUE_COUNT: 123 | UNIQUE_PCT: 0.85
+logger = logging.getLogger(__name__)
+
+# Tab-separated log format, one cache entry per line, each sorted column name in
+# its own trailing field (csv quotes any name holding a tab, quote or newline):
+# dataset_name\t123\t85.00\tcol_a\tcol_b
+
+# HyperLogLog screening of candidates before the exact count. It only pays off
+# once the exact hash set no longer fits in cache, hence the row threshold.
+APPROX_SCREEN_MIN_ROWS = 1_000_000
+HLL_PRECISION = 14
+# Relative half-width of the screening interval: three standard errors of a
+# sketch with 2**HLL_PRECISION registers (about 2.4% at precision 14).
+HLL_SLACK = 3 * 1.04 / math.sqrt(1 << HLL_PRECISION)
+# Exact scoring runs in kernel calls of this many candidates per Numba thread,
+# so a stage that saturates early skips the remaining calls.
+SCORE_CHUNK_PER_THREAD = 4
+# New log rows are buffered across stages and appended once this many have
+# accumulated, plus once more when the search ends.
+LOG_FLUSH_ROWS = 10_000
+
+
+@njit(cache=True, nogil=True)
+def _new_hash_set(n: int):
+    """
+    Allocates an open-addressing (linear probing) uint64 hash set sized to the
+    next power of two above 2 * n, n being the expected number of distinct
+    keys. Returns (table, occupied, shift, mask).
+    """
+    size = 2
+    bits = 1
+    while size < 2 * n:
+        size <<= 1
+        bits += 1
+    table = np.empty(size, dtype=np.uint64)
+    occupied = np.zeros(size, dtype=np.bool_)
+    return table, occupied, np.uint64(64 - bits), np.uint64(size - 1)
+
+
+@njit(cache=True, nogil=True)
+def _hash_set_add(table, occupied, shift, mask, key) -> int:
+    """
+    Inserts key into the set; returns 1 if it was new, 0 otherwise. Slots come
+    from Fibonacci hashing, so dense integer keys spread evenly.
+    """
+    slot = (key * np.uint64(0x9E3779B97F4A7C15)) >> shift
+    while occupied[slot]:
+        if table[slot] == key:
+            return 0
+        slot = (slot + np.uint64(1)) & mask
+    occupied[slot] = True
+    table[slot] = key
+    return 1
+
+
+@njit(cache=True, nogil=True)
+def _row_key(codes: np.ndarray, radices: np.ndarray, cols: np.ndarray, exact: bool, i: int) -> np.uint64:
+    """
+    Combines the codes of row i over cols into one uint64 key. While the
+    product of the radices fits in 64 bits the mixed-radix key is exact;
+    beyond that the codes are hash-combined.
+    """
+    key = np.uint64(codes[cols[0], i])
+    for j in cols[1:]:
+        if exact:
+            key = key * radices[j] + np.uint64(codes[j, i])
+        else:
+            key ^= key >> np.uint64(32)
+            key *= np.uint64(0x9E3779B97F4A7C15)
+            key += np.uint64(codes[j, i])
+    return key
+
+
+# Fixed-width kernels for the common small combinations: the mixed-radix key
+# is built in registers row by row, without the generic per-column loop.
+# Each set is sized from capacity, an upper bound on the candidate's n_unique
+# (a few keys need a few slots, not 2 * n_rows). Should a bound derived from
+# a stale log understate the count, the set is never let past half full: the
+# count restarts with a set sized for every row.
+
+@njit(cache=True, nogil=True)
+def _n_unique_codes1(a: np.ndarray, capacity: int) -> int:
+    table, occupied, shift, mask = _new_hash_set(capacity)
+    limit = table.shape[0] // 2
+    count = 0
+    for i in range(a.shape[0]):
+        count += _hash_set_add(table, occupied, shift, mask, np.uint64(a[i]))
+        if count > limit:
+            return _n_unique_codes1(a, a.shape[0])
+    return count
+
+
+@njit(cache=True, nogil=True)
+def _n_unique_codes2(a: np.ndarray, b: np.ndarray, rb: np.uint64, capacity: int) -> int:
+    table, occupied, shift, mask = _new_hash_set(capacity)
+    limit = table.shape[0] // 2
+    count = 0
+    for i in range(a.shape[0]):
+        key = np.uint64(a[i]) * rb + np.uint64(b[i])
+        count += _hash_set_add(table, occupied, shift, mask, key)
+        if count > limit:
+            return _n_unique_codes2(a, b, rb, a.shape[0])
+    return count
+
+
+@njit(cache=True, nogil=True)
+def _n_unique_codes3(
+    a: np.ndarray, b: np.ndarray, c: np.ndarray, rb: np.uint64, rc: np.uint64, capacity: int
+) -> int:
+    table, occupied, shift, mask = _new_hash_set(capacity)
+    limit = table.shape[0] // 2
+    count = 0
+    for i in range(a.shape[0]):
+        key = (np.uint64(a[i]) * rb + np.uint64(b[i])) * rc + np.uint64(c[i])
+        count += _hash_set_add(table, occupied, shift, mask, key)
+        if count > limit:
+            return _n_unique_codes3(a, b, c, rb, rc, a.shape[0])
+    return count
+
+
+@njit(cache=True, nogil=True)
+def _n_unique_codes4(
+    a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray, rb: np.uint64, rc: np.uint64, rd: np.uint64,
+    capacity: int,
+) -> int:
+    table, occupied, shift, mask = _new_hash_set(capacity)
+    limit = table.shape[0] // 2
+    count = 0
+    for i in range(a.shape[0]):
+        key = ((np.uint64(a[i]) * rb + np.uint64(b[i])) * rc + np.uint64(c[i])) * rd + np.uint64(d[i])
+        count += _hash_set_add(table, occupied, shift, mask, key)
+        if count > limit:
+            return _n_unique_codes4(a, b, c, d, rb, rc, rd, a.shape[0])
+    return count
+
+
+@njit(cache=True, nogil=True)
+def _n_unique_codes_n(
+    codes: np.ndarray, radices: np.ndarray, cols: np.ndarray, exact: bool, capacity: int
+) -> int:
+    """Any width, keys combined by _row_key."""
+    n_rows = codes.shape[1]
+    table, occupied, shift, mask = _new_hash_set(capacity)
+    limit = table.shape[0] // 2
+    count = 0
+    for i in range(n_rows):
+        count += _hash_set_add(table, occupied, shift, mask, _row_key(codes, radices, cols, exact, i))
+        if count > limit:
+            return _n_unique_codes_n(codes, radices, cols, exact, n_rows)
+    return count
+
+
+@njit(cache=True, nogil=True, parallel=True)
+def _n_unique_all(
+    codes: np.ndarray, radices: np.ndarray, offsets: np.ndarray, flat_cols: np.ndarray, exact: np.ndarray,
+    capacity: np.ndarray,
+) -> np.ndarray:
+    """
+    Exact n_unique of every candidate in one call, candidates spread over
+    Numba's thread pool. codes is a (n_cols, n_rows) uint32 matrix and
+    candidate k uses the rows flat_cols[offsets[k]:offsets[k + 1]] of it;
+    capacity[k] bounds its n_unique and sizes its hash set.
+    """
+    n_cand = offsets.shape[0] - 1
+    out = np.empty(n_cand, dtype=np.int64)
+    for k in prange(n_cand):
+        cols = flat_cols[offsets[k]:offsets[k + 1]]
+        r = cols.shape[0]
+        if exact[k] and r == 1:
+            out[k] = _n_unique_codes1(codes[cols[0]], capacity[k])
+        elif exact[k] and r == 2:
+            out[k] = _n_unique_codes2(codes[cols[0]], codes[cols[1]], radices[cols[1]], capacity[k])
+        elif exact[k] and r == 3:
+            out[k] = _n_unique_codes3(
+                codes[cols[0]], codes[cols[1]], codes[cols[2]], radices[cols[1]], radices[cols[2]], capacity[k]
+            )
+        elif exact[k] and r == 4:
+            out[k] = _n_unique_codes4(
+                codes[cols[0]], codes[cols[1]], codes[cols[2]], codes[cols[3]],
+                radices[cols[1]], radices[cols[2]], radices[cols[3]], capacity[k],
+            )
+        else:
+            out[k] = _n_unique_codes_n(codes, radices, cols, exact[k], capacity[k])
+    return out
+
+
+@njit(cache=True, nogil=True, parallel=True)
+def _approx_n_unique_all(
+    codes: np.ndarray, radices: np.ndarray, offsets: np.ndarray, flat_cols: np.ndarray, exact: np.ndarray,
+    precision: int,
+) -> np.ndarray:
+    """
+    HyperLogLog estimate (2**precision one-byte registers, linear counting
+    for small cardinalities) of every candidate's n_unique, laid out as in
+    _n_unique_all.
+    """
+    n_rows = codes.shape[1]
+    n_cand = offsets.shape[0] - 1
+    m = 1 << precision
+    max_rank = 64 - precision + 1
+    top_bit = np.uint64(0x8000000000000000)
+    out = np.empty(n_cand, dtype=np.float64)
+    for k in prange(n_cand):
+        cols = flat_cols[offsets[k]:offsets[k + 1]]
+        registers = np.zeros(m, dtype=np.uint8)
+        for i in range(n_rows):
+            # splitmix64 finalizer, so the register index and rank see well-mixed bits
+            h = _row_key(codes, radices, cols, exact[k], i)
+            h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            h = h ^ (h >> np.uint64(31))
+            idx = h >> np.uint64(64 - precision)
+            w = h << np.uint64(precision)
+            rank = 1
+            while rank < max_rank and (w & top_bit) == 0:
+                w = w << np.uint64(1)
+                rank += 1
+            if rank > registers[idx]:
+                registers[idx] = rank
+        total = 0.0
+        zeros = 0
+        for j in range(m):
+            total += 2.0 ** (-np.float64(registers[j]))
+            if registers[j] == 0:
+                zeros += 1
+        estimate = 0.7213 / (1.0 + 1.079 / m) * m * m / total
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * np.log(m / zeros)
+        out[k] = estimate
+    return out
+
+
+def _pack_candidates(
+    combo_keys: List[tuple],
+    stage_index: Dict[str, int],
+    column_radix: Dict[str, int],
+    upper_bound: Dict[tuple, int],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Flattens candidate column lists into (offsets, flat_cols, exact, capacity)
+    arrays for the batch kernels. exact marks candidates whose mixed-radix key
+    fits in 64 bits; capacity is each candidate's upper bound on n_unique, which
+    sizes its exact hash set.
+    """
+    offsets = np.zeros(len(combo_keys) + 1, dtype=np.int64)
+    np.cumsum([len(k) for k in combo_keys], out=offsets[1:])
+    flat_cols = np.fromiter(
+        (stage_index[c] for k in combo_keys for c in k), dtype=np.int64, count=int(offsets[-1])
+    )
+    exact = np.array([math.prod(column_radix[c] for c in k) < 1 << 64 for k in combo_keys], dtype=np.bool_)
+    capacity = np.array([upper_bound[k] for k in combo_keys], dtype=np.int64)
+    return offsets, flat_cols, exact, capacity
+
+
+def _iter_n_unique(
+    combo_keys: List[tuple],
+    codes: np.ndarray,
+    radices: np.ndarray,
+    stage_index: Dict[str, int],
+    column_radix: Dict[str, int],
+    upper_bound: Dict[tuple, int],
+) -> Iterator[int]:
+    """Yields the exact n_unique of each candidate in order, one chunk per kernel call."""
+    chunk_size = SCORE_CHUNK_PER_THREAD * numba.get_num_threads()
+    for start in range(0, len(combo_keys), chunk_size):
+        chunk = combo_keys[start:start + chunk_size]
+        yield from _n_unique_all(
+            codes, radices, *_pack_candidates(chunk, stage_index, column_radix, upper_bound)
+        ).tolist()
+
 
 def parse_log_file(log_path: str, dataset_name: str) -> Dict[tuple, int]:
     """
@@ -21,40 +296,23 @@ def parse_log_file(log_path: str, dataset_name: str) -> Dict[tuple, int]:
         Dict[tuple, int]: A dictionary mapping a column combination (tuple) to its unique count.
     """
     existing_results = {}
-    print(f"Reading history from '{log_path}' for dataset '{dataset_name}'...")
+    logger.info("Reading history from '%s' for dataset '%s'...", log_path, dataset_name)
     if not os.path.exists(log_path):
-        print("Log file not found. Starting fresh.")
+        logger.info("Log file not found. Starting fresh.")
         return existing_results
 
-    with open(log_path, "r") as f:
-        for line in f:
-            if not line.startswith("CACHE_ENTRY"):
+    with open(log_path, "r", newline="") as f:
+        for row in csv.reader(f, delimiter="\t"):
+            # [dataset_name, num_unique, unique_pct, col_a, col_b, ...]
+            if len(row) < 4 or row[0] != dataset_name:
+                # Ignore other datasets and malformed lines
                 continue
-            
             try:
-                parts = [p.strip() for p in line.split('|')]
-                # ['CACHE_ENTRY', 'DATASET: ...', 'COLUMNS: ...', 'UNIQUE_COUNT: ...', ...]
-                
-                log_dataset = parts[1].split(':', 1)[1].strip()
-                
-                if log_dataset == dataset_name:
-                    # Safely parse the string representation of the list
-                    columns_str = parts[2].split(':', 1)[1].strip()
-                    columns_list = ast.literal_eval(columns_str)
-                    
-                    # The key for our dictionary is a sorted tuple
-                    combo_key = tuple(sorted(columns_list))
-                    
-                    # Get the unique count
-                    unique_count = int(parts[3].split(':', 1)[1].strip())
-                    
-                    existing_results[combo_key] = unique_count
-            except (IndexError, SyntaxError, ValueError) as e:
-                # Ignore malformed lines
-                # print(f"Warning: Skipping malformed log line: {line.strip()} - Error: {e}")
+                existing_results[tuple(sorted(row[3:]))] = int(row[1])
+            except ValueError:
                 pass
-                
-    print(f"Found {len(existing_results)} cached results in log file.")
+
+    logger.info("Found %d cached results in log file.", len(existing_results))
     return existing_results
 
 
@@ -70,85 +328,230 @@ def find_most_unique_column_combination_with_log(
     """
     total_rows = df.height
     all_columns = df.columns
+    if not all_columns:
+        return [], 0
 
-    # 1. Load all historical results from the log file into memory
-    existing_results = parse_log_file(log_path, dataset_name)
-    
-    # 2. Open the log file in append mode to write new results as they happen
-    with open(log_path, "a") as log_file:
-        stage_results: List[Tuple[int, frozenset]] = []
+    lf = df.lazy()
+    column_distinct = (
+        lf.select([pl.col(c).n_unique() for c in all_columns]).collect(engine="streaming").row(0, named=True)
+    )
+    # Per-column dense codes (0 for null, 1..k for the values), kept as
+    # contiguous uint32 arrays. Only equivalence classes matter for n_unique,
+    # so codes stand in for the values at 4 bytes per cell whatever the dtype.
+    # A column's radix is its distinct count + 1. Columns are encoded on first
+    # use only, so fully cached stages never touch the frame.
+    column_radix = {c: column_distinct[c] + 1 for c in all_columns}
+    column_codes: Dict[str, np.ndarray] = {}
+
+    # Combinations are carried as (sorted tuple, bitmask) pairs built once at
+    # generation time: the tuple names the combination in the log, the int
+    # bitmask (one bit per column) keys the cache, membership tests and dedup.
+    column_bits = {c: 1 << i for i, c in enumerate(all_columns)}
+
+    # 1. Load all historical results from the log file into memory, keyed by
+    # bitmask (entries naming columns this frame no longer has are dropped).
+    # Bits are OR-ed, so a column listed twice maps to the same set as once.
+    existing_results: Dict[int, int] = {
+        functools.reduce(operator.or_, (column_bits[c] for c in combo_key), 0): num_unique
+        for combo_key, num_unique in parse_log_file(log_path, dataset_name).items()
+        if all(c in column_bits for c in combo_key)
+    }
+
+    # 2. Open the log file in append mode; new results are buffered and appended in batches
+    with open(log_path, "a", newline="") as log_file:
+        log_writer = csv.writer(log_file, delimiter="\t")
+        new_log_rows = []
+        stage_results: List[Tuple[int, tuple, int]] = []
         overall_best_combination = []
         overall_max_unique_rows = 0
+        # Discovered functional dependencies T -> c, keyed by the dependent
+        # column c. If n_unique(T | {c}) == n_unique(T), then any superset of
+        # T gains nothing from c, so such extensions are not generated.
+        determining_masks: Dict[str, List[int]] = {}
 
-        for r in range(1, len(all_columns) + 1):
-            print(f"\n--- Checking combinations of length {r} ---")
-            current_stage_candidates: List[List[str]] = []
-            checked_combinations_this_stage: set[frozenset] = set()
-
-            if r == 1:
-                current_stage_candidates = [[col] for col in all_columns]
-            else:
-                for _, prev_combo_frozenset in stage_results:
-                    for col in all_columns:
-                        if col not in prev_combo_frozenset:
-                            new_combo = sorted(list(prev_combo_frozenset) + [col])
-                            new_combo_frozenset = frozenset(new_combo)
-                            if new_combo_frozenset not in checked_combinations_this_stage:
-                                current_stage_candidates.append(new_combo)
-                                checked_combinations_this_stage.add(new_combo_frozenset)
-            
-            current_stage_metrics = []
-            hits_from_cache = 0
-            for combo_names_list in current_stage_candidates:
-                combo_key = tuple(sorted(combo_names_list))
-
-                if combo_key in existing_results:
-                    # --- CACHE HIT ---
-                    num_unique = existing_results[combo_key]
-                    hits_from_cache += 1
+        try:
+            for r in range(1, len(all_columns) + 1):
+                logger.debug("--- Checking combinations of length %d ---", r)
+                current_stage_candidates: List[Tuple[tuple, int]] = []
+                checked_combinations_this_stage: set[int] = set()
+
+                if r == 1:
+                    current_stage_candidates = [((col,), bit) for col, bit in column_bits.items()]
                 else:
-                    # --- CACHE MISS ---
-                    # Perform the expensive calculation
-                    num_unique = df.select(pl.struct(combo_key).n_unique()).item()
-                    
-                    # Add to in-memory cache for this run
-                    existing_results[combo_key] = num_unique
-                    
-                    # Append the new result to the log file immediately
-                    unique_percentage = (num_unique / total_rows * 100) if total_rows > 0 else 0.0
-                    log_entry = (
-                        f"CACHE_ENTRY | DATASET: {dataset_name} | COLUMNS: {sorted(list(combo_key))} | "
-                        f"UNIQUE_COUNT: {num_unique} | UNIQUE_PCT: {unique_percentage:.2f}"
-                    )
-                    log_file.write(log_entry + "\n")
-
-                current_stage_metrics.append((num_unique, frozenset(combo_key)))
-
-                if num_unique > overall_max_unique_rows:
-                    overall_max_unique_rows = num_unique
-                    overall_best_combination = list(combo_key)
+                    for _, prev_combo_key, prev_combo_mask in stage_results:
+                        for col, bit in column_bits.items():
+                            if prev_combo_mask & bit:
+                                continue
+                            new_combo_mask = prev_combo_mask | bit
+                            if new_combo_mask in checked_combinations_this_stage:
+                                continue
+                            checked_combinations_this_stage.add(new_combo_mask)
+                            if any(lhs & prev_combo_mask == lhs for lhs in determining_masks.get(col, ())):
+                                continue
+                            # prev_combo_key is already sorted, so insert col in place
+                            pos = bisect.bisect(prev_combo_key, col)
+                            new_combo_key = prev_combo_key[:pos] + (col,) + prev_combo_key[pos:]
+                            current_stage_candidates.append((new_combo_key, new_combo_mask))
 
-                if overall_max_unique_rows == total_rows:
-                    break
+                current_stage_metrics = []
+
+                # Bound each candidate from its cached (r-1)-subsets: adding a
+                # column never lowers n_unique and at most multiplies it by that
+                # column's distinct count. Cached candidates are known exactly.
+                lower_bound: Dict[tuple, int] = {}
+                upper_bound: Dict[tuple, int] = {}
+                for k, m in current_stage_candidates:
+                    if m in existing_results:
+                        lower_bound[k] = upper_bound[k] = existing_results[m]
+                        continue
+                    lo, hi = 0, min(total_rows, math.prod(column_distinct[c] for c in k))
+                    for c in k:
+                        subset_unique = existing_results.get(m & ~column_bits[c])
+                        if subset_unique is not None:
+                            lo = max(lo, subset_unique)
+                            hi = min(hi, subset_unique * column_distinct[c])
+                    lower_bound[k], upper_bound[k] = lo, hi
+                # A cached subset that is already unique makes the candidate
+                # unique without computing it.
+                saturated = {
+                    k for k, m in current_stage_candidates
+                    if m not in existing_results and lower_bound[k] == total_rows
+                }
+                # Visit known-unique candidates (cached or saturated) first, then
+                # the rest by descending upper bound, so the saturation break
+                # below fires as early as possible.
+                current_stage_candidates.sort(
+                    key=lambda cand: (lower_bound[cand[0]] == total_rows, upper_bound[cand[0]]),
+                    reverse=True,
+                )
+                if current_stage_candidates and lower_bound[current_stage_candidates[0][0]] == total_rows:
+                    # The first candidate ends the search, so nothing in this
+                    # stage needs encoding or scoring.
+                    uncached = []
+                else:
+                    uncached = [
+                        k for k, m in current_stage_candidates
+                        if m not in existing_results and k not in saturated
+                    ]
+
+                # --- BRANCH AND BOUND ---
+                # A miss whose upper bound is below the top_n-th lower bound can
+                # neither be carried over nor become the overall best, so it is
+                # never computed (and not logged).
+                pruned = set()
+                if len(current_stage_candidates) > top_n_to_carry_over > 0:
+                    cutoff = heapq.nlargest(top_n_to_carry_over, lower_bound.values())[-1]
+                    pruned = {k for k in uncached if upper_bound[k] < cutoff}
+                    uncached = [k for k in uncached if k not in pruned]
+
+                # Project just the columns referenced by this stage's misses:
+                # encode the new ones in one narrow query, then stack them into an
+                # (n_cols, n_rows) matrix, one contiguous row per column, for the
+                # batch kernels.
+                stage_columns = [c for c in all_columns if any(c in k for k in uncached)]
+                unencoded = [c for c in stage_columns if c not in column_codes]
+                if unencoded:
+                    codes_df = lf.select(
+                        [pl.col(c).rank("dense").fill_null(0).cast(pl.UInt32).alias(c) for c in unencoded]
+                    ).collect(engine="streaming")
+                    column_codes.update({c: codes_df[c].to_numpy() for c in unencoded})
+                stage_index = {c: i for i, c in enumerate(stage_columns)}
+                stage_codes = np.stack([column_codes[c] for c in stage_columns]) if stage_columns else None
+                stage_radices = np.array([column_radix[c] for c in stage_columns], dtype=np.uint64)
+
+                # --- APPROXIMATE SCREEN ---
+                # On large frames, estimate every miss with HyperLogLog first. A
+                # candidate whose optimistic estimate is below the top_n-th
+                # pessimistic one can neither be carried over nor become the
+                # overall best, so its exact count is skipped (and not logged).
+                screened_out = set()
+                if total_rows >= APPROX_SCREEN_MIN_ROWS and len(uncached) > top_n_to_carry_over > 0:
+                    offsets, flat_cols, exact, _ = _pack_candidates(uncached, stage_index, column_radix, upper_bound)
+                    estimates = dict(zip(uncached, _approx_n_unique_all(
+                        stage_codes, stage_radices, offsets, flat_cols, exact, HLL_PRECISION
+                    ).tolist()))
+                    lower_bounds = [
+                        max(lower_bound[k], estimates[k] * (1 - HLL_SLACK)) if k in estimates
+                        else lower_bound[k]
+                        for k, _ in current_stage_candidates
+                    ]
+                    cutoff = heapq.nlargest(top_n_to_carry_over, lower_bounds)[-1]
+                    screened_out = {
+                        k for k, est in estimates.items()
+                        if min(total_rows, est * (1 + HLL_SLACK)) < cutoff
+                    }
+                    uncached = [k for k in uncached if k not in screened_out]
+
+                # --- CACHE MISSES ---
+                # Scored by the parallel batch kernel, consumed lazily in
+                # candidate order: once the search saturates, closing the
+                # iterator skips the chunks not yet scored.
+                uncached_counts = _iter_n_unique(
+                    uncached, stage_codes, stage_radices, stage_index, column_radix, upper_bound
+                )
+                hits_from_cache = 0
+                for combo_key, combo_mask in current_stage_candidates:
+                    if combo_key in pruned or combo_key in screened_out:
+                        continue
+                    if combo_mask in existing_results:
+                        # --- CACHE HIT ---
+                        num_unique = existing_results[combo_mask]
+                        hits_from_cache += 1
+                    else:
+                        num_unique = total_rows if combo_key in saturated else next(uncached_counts)
+
+                        # Add to in-memory cache for this run
+                        existing_results[combo_mask] = num_unique
+
+                        # Queue the new result for the next batched log write
+                        unique_percentage = (num_unique / total_rows * 100) if total_rows > 0 else 0.0
+                        new_log_rows.append(
+                            [dataset_name, num_unique, f"{unique_percentage:.2f}", *combo_key]
+                        )
 
-            print(f"Processed {len(current_stage_candidates)} combinations. ({hits_from_cache} from log file)")
+                    current_stage_metrics.append((num_unique, combo_key, combo_mask))
 
-            if overall_max_unique_rows == total_rows:
-                break
+                    for col in combo_key if r > 1 else ():
+                        lhs_mask = combo_mask & ~column_bits[col]
+                        if existing_results.get(lhs_mask) == num_unique:
+                            determining_masks.setdefault(col, []).append(lhs_mask)
+
+                    if num_unique > overall_max_unique_rows:
+                        overall_max_unique_rows = num_unique
+                        overall_best_combination = list(combo_key)
+
+                    if overall_max_unique_rows == total_rows:
+                        break
+                uncached_counts.close()
+                if len(new_log_rows) >= LOG_FLUSH_ROWS:
+                    log_writer.writerows(new_log_rows)
+                    new_log_rows.clear()
+
+                logger.info(
+                    "Length %d: processed %d combinations (%d from log file, %d pruned, %d screened out).",
+                    r, len(current_stage_metrics), hits_from_cache, len(pruned), len(screened_out),
+                )
+
+                if overall_max_unique_rows == total_rows:
+                    break
             
-            current_stage_metrics.sort(key=lambda x: x[0], reverse=True)
-            stage_results = current_stage_metrics[:top_n_to_carry_over]
+                stage_results = heapq.nlargest(top_n_to_carry_over, current_stage_metrics, key=lambda x: x[0])
             
-            if not stage_results:
-                break
+                if not stage_results:
+                    break
+        finally:
+            # Buffered rows are written even if the search is interrupted, so
+            # counts already paid for are cached for the next run.
+            log_writer.writerows(new_log_rows)
 
-    print("\n--- Process Finished ---")
-    print(f"Most unique column combination: {overall_best_combination}")
-    print(f"Number of unique rows with this combination: {overall_max_unique_rows}")
+    logger.info("Most unique column combination: %s", overall_best_combination)
+    logger.info("Number of unique rows with this combination: %d", overall_max_unique_rows)
     return overall_best_combination, overall_max_unique_rows
 
 # --- Example Usage ---
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
     data = {
         "id": [1, 1, 2, 3, 3, 4],
         "name": ["Alice", "Alice", "Bob", "Charlie", "Charlie", "David"],
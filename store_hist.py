@@ -1,8 +1,19 @@
 import polars as pl
+import pyarrow as pa
 import itertools
 from typing import List, Tuple, Dict
+import glob
+import mmap
 import os
 import time
+import uuid
+
+# RE2 matches in linear time without backtracking; the stdlib engine
+# accepts the same pattern when the binding is not installed.
+try:
+    import re2 as re
+except ImportError:
+    import re
 
 # Define the schema for the cache to ensure consistency with the main script
 CACHE_SCHEMA = {
@@ -12,30 +23,48 @@ CACHE_SCHEMA = {
     "unique_percentage": pl.Float64,
 }
 
-def parse_history_log(log_file_path: str) -> List[Tuple[List[str], int, float]]:
+# Matched against the raw bytes of the whole file, so the gap between the
+# column list and the count must not run past the end of its line. A match
+# therefore never spans lines, and only the first one on each line is kept.
+HISTORY_LINE_PATTERN = re.compile(rb"Testing \[(.*?)\][^\d\n]*(\d+) unique rows \((.*?)%\)")
+
+def parse_history_log(log_file_path: str) -> Tuple[List[str], List[int], List[int], List[float]]:
     """
     Parses a log file to extract column combinations and their uniqueness stats.
+
+    Returns columnar lists (cols_flat, cols_offsets, num_unique, unique_fraction):
+    record i's sorted columns are cols_flat[cols_offsets[i]:cols_offsets[i + 1]],
+    i.e. the values and offsets of an Arrow list array.
     """
-    pattern = re.compile(r"Testing \[(.*?)\][^\d]*(\d+) unique rows \((.*?)%\)")
-    parsed_records = []
+    pattern = HISTORY_LINE_PATTERN
+    cols_flat: List[str] = []
+    cols_offsets: List[int] = [0]
+    num_unique_out: List[int] = []
+    pct_out: List[float] = []
     print(f"Reading history file: {log_file_path}")
 
     try:
-        with open(log_file_path, 'r') as f:
-            for line in f:
-                match = pattern.search(line)
-                if match:
-                    column_str = match.group(1)
-                    columns = [col.strip().strip("'\"") for col in column_str.split(',')]
-                    num_unique = int(match.group(2))
-                    percentage = float(match.group(3))
-                    parsed_records.append((sorted(columns), num_unique, percentage / 100.0))
+        # Scan the mapped file in one pass; only the matched groups are decoded.
+        with open(log_file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    next_line = 0
+                    for match in pattern.finditer(mm):
+                        if match.start() < next_line:
+                            continue  # a later record on an already matched line
+                        line_end = mm.find(b"\n", match.end())
+                        next_line = len(mm) if line_end < 0 else line_end + 1
+                        column_str = match.group(1).decode('utf-8')
+                        cols_flat.extend(sorted(col.strip().strip("'\"") for col in column_str.split(',')))
+                        cols_offsets.append(len(cols_flat))
+                        num_unique_out.append(int(match.group(2)))
+                        pct_out.append(float(match.group(3)) / 100.0)
     except FileNotFoundError:
         print(f"Error: The file '{log_file_path}' was not found.")
-        return []
+        return [], [0], [], []
         
-    print(f"Successfully parsed {len(parsed_records)} records from the log file.")
-    return parsed_records
+    print(f"Successfully parsed {len(num_unique_out)} records from the log file.")
+    return cols_flat, cols_offsets, num_unique_out, pct_out
 
 
 def preload_cache_from_history(
@@ -44,38 +73,69 @@ def preload_cache_from_history(
     historical_dataset_name: str
 ):
     """
-    Parses a history log file and loads its data into the Parquet cache,
-    handling duplicates with any existing cache data.
+    Parses a history log file and loads its data into the Parquet cache
+    directory at cache_path, skipping entries the cache already holds.
     """
-    parsed_records = parse_history_log(history_file_path)
-    if not parsed_records:
+    cols_flat, cols_offsets, num_unique_list, unique_percentage_list = parse_history_log(history_file_path)
+    if not num_unique_list:
         print("No records to add to the cache. Exiting.")
         return
 
-    columns_list, num_unique_list, unique_percentage_list = zip(*parsed_records)
+    # Assemble the frame from Arrow buffers: the list column is built straight
+    # from the flat names and their offsets, with no per-record Python lists.
+    new_history_df = pl.from_arrow(pa.table({
+        "dataset_name": pa.array([historical_dataset_name] * len(num_unique_list), pa.large_utf8()),
+        "columns": pa.LargeListArray.from_arrays(
+            pa.array(cols_offsets, pa.int64()), pa.array(cols_flat, pa.large_utf8())
+        ),
+        "num_unique": pa.array(num_unique_list, pa.int64()),
+        "unique_percentage": pa.array(unique_percentage_list, pa.float64()),
+    }))
 
-    new_history_df = pl.DataFrame({
-        "dataset_name": pl.Series([historical_dataset_name] * len(columns_list), dtype=CACHE_SCHEMA["dataset_name"]),
-        "columns": pl.Series(columns_list, dtype=CACHE_SCHEMA["columns"]),
-        "num_unique": pl.Series(num_unique_list, dtype=CACHE_SCHEMA["num_unique"]),
-        "unique_percentage": pl.Series(unique_percentage_list, dtype=CACHE_SCHEMA["unique_percentage"]),
-    })
+    # The cache is a directory of Parquet shards. Column lists already cached
+    # for this dataset (or repeated within this log) are dropped through a key
+    # set, and the rest are written as a new shard, so existing shards are
+    # never rewritten.
+    if os.path.isfile(cache_path):
+        # A cache written before the sharded layout is a single Parquet file:
+        # move it into the directory as the first shard so its rows are kept.
+        legacy_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+        os.replace(cache_path, legacy_path)
+        os.makedirs(cache_path)
+        migrated_path = os.path.join(cache_path, f"part-{uuid.uuid4().hex}.parquet")
+        os.replace(legacy_path, migrated_path)
+        print(f"Migrated single-file cache to shard: {migrated_path}")
 
-    if os.path.exists(cache_path):
+    shard_glob = os.path.join(cache_path, "*.parquet")
+    if glob.glob(shard_glob):
         print(f"Loading existing cache from: {cache_path}")
-        existing_cache_df = pl.read_parquet(cache_path)
-        combined_df = pl.concat([existing_cache_df, new_history_df])
-        final_df = combined_df.unique(subset=["dataset_name", "columns"], keep="first")
-        num_added = len(final_df) - len(existing_cache_df)
-        print(f"Added {num_added} new records to the existing cache.")
+        # Only this dataset's column lists are needed: the filter and
+        # projection are pushed into the scan, so other datasets' rows and
+        # the stats columns are never materialized.
+        existing_columns = (
+            pl.scan_parquet(shard_glob)
+            .filter(pl.col("dataset_name") == historical_dataset_name)
+            .select(pl.col("columns").cast(CACHE_SCHEMA["columns"]))
+            .collect(engine="streaming")
+        )
+        seen_keys = set(map(tuple, existing_columns["columns"].to_list()))
     else:
         print("No existing cache found. Creating a new one.")
-        final_df = new_history_df
-        print(f"Added {len(final_df)} new records to the new cache.")
+        seen_keys = set()
+
+    keep_mask = []
+    for start, end in zip(cols_offsets, cols_offsets[1:]):
+        key = tuple(cols_flat[start:end])
+        keep_mask.append(key not in seen_keys)
+        seen_keys.add(key)
+    final_df = new_history_df.filter(pl.Series(keep_mask))
+    print(f"Added {len(final_df)} new records to the cache.")
+    if final_df.is_empty():
+        return
 
     # --- ROBUSTNESS FIX ---
     # Explicitly cast the 'columns' column to the correct type before saving.
-    # This guards against any previous operation (like .unique()) changing the dtype to Object.
+    # This guards against any previous operation changing the dtype to Object.
     print("\nSchema BEFORE final cast:")
     print(final_df.schema)
     
@@ -87,6 +147,7 @@ def preload_cache_from_history(
     print(final_df.schema)
     # --- END OF FIX ---
 
-    final_df.write_parquet(cache_path)
-    print(f"\nCache successfully saved to: {cache_path}")
-    return overall_best_combination, overall_max_unique_rows
+    os.makedirs(cache_path, exist_ok=True)
+    shard_path = os.path.join(cache_path, f"part-{uuid.uuid4().hex}.parquet")
+    final_df.write_parquet(shard_path)
+    print(f"\nCache shard successfully saved to: {shard_path}")
@@ -38,7 +38,10 @@ Dependencies: sqlalchemy >= 2.0
 
 from __future__ import annotations
 
+import io
 import logging
+from functools import lru_cache
+from string import Template
 from textwrap import indent
 from typing import List, Sequence, Dict, Any, Tuple
 
@@ -56,12 +59,56 @@ def _cast01(col: str) -> str:
     return f"CAST({col} AS CHAR(1))"
 
 
+# Bit N of the BIGINT key is a sentinel, so at most 62 checks fit.
+_MAX_BITWISE_CHECKS = 62
+
+
 def _build_leading_run_expr(check_cols: List[str]) -> str:
-    """SQL that yields the length of the leading run of 1s across all checks."""
-    concat_expr = "||".join(_cast01(c) for c in check_cols) + "||'0'"
-    return f"POSITION('0' IN {concat_expr}) - 1"
+    """SQL that orders rows by the length of the leading run of 1s across all checks.
+
+    Up to _MAX_BITWISE_CHECKS checks, check k sets bit k when it is 0, so
+    the lowest set bit, BITAND(x, -x), is 2**run. It ranks rows the same
+    as the run length without building a string per row. Wider tables
+    fall back to POSITION over the concatenated flags, which is the run
+    length itself.
+    """
+    if len(check_cols) > _MAX_BITWISE_CHECKS:
+        concat_expr = "||".join(_cast01(c) for c in check_cols) + "||'0'"
+        return f"POSITION('0' IN {concat_expr}) - 1"
+    zero_bits = " + ".join(
+        [f"CAST({1 << len(check_cols)} AS BIGINT)"]
+        + [f"CAST(1 - {c} AS BIGINT) * {1 << k}" for k, c in enumerate(check_cols)]
+    )
+    return f"BITAND({zero_bits}, -({zero_bits}))"
+
+
+# Per-check SQL fragments, filled once per check column.
+_METRIC_AGGS = Template(
+    "SUM(CASE WHEN $m1 THEN 1 ELSE 0 END) AS first_zero_$ord, "
+    "SUM(CASE WHEN $m2 THEN 1 ELSE 0 END) AS only_zero_$ord, "
+    "SUM(CASE WHEN $m3 THEN 1 ELSE 0 END) AS any_zero_$ord"
+)
+_UNPIVOT_COLS = Template("(first_zero_$ord, only_zero_$ord, any_zero_$ord) AS '$col'")
+_ORDER_CASE = Template(" WHEN '$col' THEN $ord")
+# One aggregate SELECT per check, for tables too wide for the single scan.
+_METRIC_SELECT = Template("""
+            SELECT
+                '$col' AS check_name,
+                $ord AS check_order,
+                SUM(CASE WHEN $m1 THEN 1 ELSE 0 END) AS first_zero,
+                SUM(CASE WHEN $m2 THEN 1 ELSE 0 END) AS only_zero,
+                SUM(CASE WHEN $m3 THEN 1 ELSE 0 END) AS any_zero,
+                COUNT(*) AS total_rows
+            FROM dedup
+            WHERE rn = 1""")
 
+# The single-scan aggregate returns 3 columns per check plus total_rows, and
+# Teradata rejects a row of more than 2048 columns, so it serves at most 682
+# checks. Wider tables aggregate each check in its own UNION ALL branch.
+_MAX_WIDE_CHECKS = (2048 - 1) // 3
 
+
+@lru_cache(maxsize=None)
 def _template_meta(col_name: str) -> Tuple[str, str, int]:
     """Split <channel>_<template>_<n> into components."""
     parts = col_name.split("_")
@@ -94,86 +141,159 @@ def run_waterfall_metrics(
     meta = {c: _template_meta(c) for c in check_cols}
     results: List[Dict[str, Any]] = []
 
-    for combo in id_col_combinations:
-        logger.info("Processing identifier combo %s", combo)
-
-        # Deduplication CTE
-        count_ones_expr = " + ".join(check_cols)
-        leading_run_expr = _build_leading_run_expr(check_cols)
-        partition_by = _comma(combo)
-
-        dedup_cte = f"""WITH dedup AS (
+    # Everything below except PARTITION BY is the same for every combo,
+    # so the SQL is assembled once and only the dedup CTE varies.
+    count_ones_expr = " + ".join(check_cols)
+    leading_run_expr = _build_leading_run_expr(check_cols)
+
+    # Up to _MAX_WIDE_CHECKS checks, all are aggregated in one pass over the
+    # deduplicated rows (first_zero_<j>, only_zero_<j>, any_zero_<j>), then
+    # unpivoted back to one row per check.
+    wide = len(check_cols) <= _MAX_WIDE_CHECKS
+    metric_selects: List[str] = []
+    metric_aggs = io.StringIO()
+    unpivot_cols = io.StringIO()
+    order_cases = io.StringIO()
+
+    # Per-channel lookup tables, built in one pass so each check below is O(1):
+    #  - scope_by_tmpl[(ch, t)]: the channel's BA checks plus its template-t
+    #    checks, in column order (a BA check's scope is just the BA checks);
+    #  - scope_index[c]: c's position within its own scope;
+    #  - prev_cols_by_tmpl[(ch, t)]: checks of the templates that first
+    #    appear before t in the channel (dependency filter, empty for the first).
+    by_channel: Dict[str, List[str]] = {}
+    for c in check_cols:
+        by_channel.setdefault(meta[c][0], []).append(c)
+
+    scope_by_tmpl: Dict[Tuple[str, str], List[str]] = {}
+    scope_index: Dict[str, int] = {}
+    prev_cols_by_tmpl: Dict[Tuple[str, str], List[str]] = {}
+    for channel, cols in by_channel.items():
+        templates = list(dict.fromkeys(meta[c][1] for c in cols))
+        for templ in templates:
+            scope = [c for c in cols if meta[c][1] in ("BA", templ)]
+            scope_by_tmpl[(channel, templ)] = scope
+            scope_index.update((c, i) for i, c in enumerate(scope) if meta[c][1] == templ)
+        non_ba = [t for t in templates if t != "BA"]
+        for i, templ in enumerate(non_ba):
+            prev_templs = set(non_ba[:i])
+            prev_cols_by_tmpl[(channel, templ)] = [c for c in cols if meta[c][1] in prev_templs]
+
+    for order_idx, col_j in enumerate(check_cols, start=1):
+        channel_j, templ_j, _ = meta[col_j]
+        scope_cols = scope_by_tmpl[(channel_j, templ_j)]
+        pos_j = scope_index[col_j]
+        prior_cols = scope_cols[:pos_j]
+        cond_m1 = f"{col_j}=0" + (" AND " + " AND ".join(f"{c}=1" for c in prior_cols) if prior_cols else "")
+        other_in_scope = prior_cols + scope_cols[pos_j + 1:]
+        cond_m2 = f"{col_j}=0" + (" AND " + " AND ".join(f"{c}=1" for c in other_in_scope) if other_in_scope else "")
+        cond_m3 = f"{col_j}=0"
+
+        dep_clause = ""
+        prev_cols = prev_cols_by_tmpl.get((channel_j, templ_j))
+        if prev_cols:
+            prev_zero_filter = " OR ".join(f"{c}=0" for c in prev_cols)
+            dep_clause = f" AND ({prev_zero_filter})"
+
+        if not wide:
+            metric_selects.append(_METRIC_SELECT.substitute(
+                col=col_j, ord=order_idx,
+                m1=cond_m1 + dep_clause, m2=cond_m2 + dep_clause, m3=cond_m3 + dep_clause,
+            ))
+            continue
+
+        sep = ", " if order_idx > 1 else ""
+        metric_aggs.write(sep + _METRIC_AGGS.substitute(
+            m1=cond_m1 + dep_clause, m2=cond_m2 + dep_clause, m3=cond_m3 + dep_clause, ord=order_idx
+        ))
+        unpivot_cols.write(sep + _UNPIVOT_COLS.substitute(col=col_j, ord=order_idx))
+        order_cases.write(_ORDER_CASE.substitute(col=col_j, ord=order_idx))
+
+    if wide:
+        metrics_raw_sql = f"""
+        metrics_wide AS (
             SELECT
-                { _comma(col_order) },
-                ROW_NUMBER() OVER (
-                    PARTITION BY {partition_by}
-                    ORDER BY {count_ones_expr} DESC,
-                             {leading_run_expr} DESC
-                ) AS rn
-            FROM {schema_name}.{table_name}
-        )"""
-
-        # Create secondary index on identifier cols (idempotent)
-        try:
-            with engine.begin() as conn:
-                conn.execute(text(
-                    f"CREATE INDEX ({_comma(combo)}) ON {schema_name}.{table_name}"
-                ))
-        except Exception:
-            pass  # likely exists
-
-        metric_selects = []
-        total_rows_sql = "(SELECT COUNT(*) FROM dedup WHERE rn = 1)"
-
-        for order_idx, col_j in enumerate(check_cols, start=1):
-            channel_j, templ_j, _ = meta[col_j]
-            scope_cols = [
-                c for c in check_cols
-                if meta[c][0] == channel_j and (meta[c][1] == "BA" or meta[c][1] == templ_j)
-            ]
-            prior_cols = scope_cols[: scope_cols.index(col_j)]
-            cond_m1 = f"{col_j}=0" + (" AND " + " AND ".join(f"{c}=1" for c in prior_cols) if prior_cols else "")
-            other_in_scope = [c for c in scope_cols if c != col_j]
-            cond_m2 = f"{col_j}=0" + (" AND " + " AND ".join(f"{c}=1" for c in other_in_scope) if other_in_scope else "")
-            cond_m3 = f"{col_j}=0"
-
-            channel_templates = [meta[c][1] for c in check_cols if meta[c][0] == channel_j and meta[c][1] != "BA"]
-            dep_clause = ""
-            if templ_j != "BA" and channel_templates.index(templ_j) > 0:
-                prev_templs = channel_templates[: channel_templates.index(templ_j)]
-                prev_cols = [c for c in check_cols if meta[c][0] == channel_j and meta[c][1] in prev_templs]
-                prev_zero_filter = " OR ".join(f"{c}=0" for c in prev_cols)
-                dep_clause = f" AND ({prev_zero_filter})"
-
-            metric_selects.append(f"""
-            SELECT
-                '{col_j}' AS check_name,
-                {order_idx} AS check_order,
-                SUM(CASE WHEN {cond_m1}{dep_clause} THEN 1 ELSE 0 END) AS first_zero,
-                SUM(CASE WHEN {cond_m2}{dep_clause} THEN 1 ELSE 0 END) AS only_zero,
-                SUM(CASE WHEN {cond_m3}{dep_clause} THEN 1 ELSE 0 END) AS any_zero
+                COUNT(*) AS total_rows,
+                {metric_aggs.getvalue()}
             FROM dedup
-            WHERE rn = 1""")
-
+            WHERE rn = 1
+        ),
+        metrics_raw AS (
+            SELECT
+                check_name,
+                CASE check_name{order_cases.getvalue()} END AS check_order,
+                first_zero,
+                only_zero,
+                any_zero,
+                total_rows
+            FROM metrics_wide
+            UNPIVOT INCLUDE NULLS ((first_zero, only_zero, any_zero) FOR check_name IN (
+                {unpivot_cols.getvalue()}
+            )) u
+        )"""
+    else:
+        logger.info("%d checks exceed the single-scan limit of %d; aggregating per check",
+                    len(check_cols), _MAX_WIDE_CHECKS)
         metrics_union = "\nUNION ALL\n".join(metric_selects)
-        final_sql = f"""{dedup_cte},
+        metrics_raw_sql = f"""
         metrics_raw AS (
             {metrics_union}
-        )
+        )"""
+
+    metrics_sql = f"""{metrics_raw_sql}
         SELECT
-            m.*,
+            m.check_name,
+            m.check_order,
+            m.first_zero,
+            m.only_zero,
+            m.any_zero,
             SUM(first_zero) OVER (ORDER BY check_order) AS running_first_zero,
-            ({total_rows_sql}) - SUM(first_zero) OVER (ORDER BY check_order) AS remaining
+            total_rows - SUM(first_zero) OVER (ORDER BY check_order) AS remaining
         FROM metrics_raw m
         ORDER BY check_order"""
 
-        with engine.connect() as conn:
-            rows = [dict(r) for r in conn.execute(text(final_sql)).fetchall()]
-
-        results.append({
-            "identifier_combo": combo,
-            "total_rows": rows[0]["running_first_zero"] + rows[0]["remaining"] if rows else 0,
-            "metrics": rows
-        })
+    # One connection serves every combo; the index DDL and the metrics query
+    # each run in their own transaction on it.
+    with engine.connect() as conn:
+        for combo in id_col_combinations:
+            logger.info("Processing identifier combo %s", combo)
+
+            # Deduplication CTE
+            partition_by = _comma(combo)
+
+            dedup_cte = f"""WITH dedup AS (
+                SELECT
+                    { _comma(col_order) },
+                    ROW_NUMBER() OVER (
+                        PARTITION BY {partition_by}
+                        ORDER BY {count_ones_expr} DESC,
+                                 {leading_run_expr} DESC
+                    ) AS rn
+                FROM {schema_name}.{table_name}
+            )"""
+
+            # Create secondary index on identifier cols (idempotent)
+            try:
+                with conn.begin():
+                    conn.execute(text(
+                        f"CREATE INDEX ({partition_by}) ON {schema_name}.{table_name}"
+                    ))
+            except Exception:
+                pass  # likely exists
+
+            final_sql = f"{dedup_cte},{metrics_sql}"
+
+            # One row per check: build the dicts from the result keys rather
+            # than dict(Row), which SQLAlchemy 2.0 rows no longer support.
+            with conn.begin():
+                result = conn.execute(text(final_sql))
+                keys = list(result.keys())
+                rows = [dict(zip(keys, r)) for r in result]
+
+            results.append({
+                "identifier_combo": combo,
+                "total_rows": rows[0]["running_first_zero"] + rows[0]["remaining"] if rows else 0,
+                "metrics": rows
+            })
 
     return results
@@ -1,15 +1,16 @@
 from pathlib import Path
 import logging, types, sys
 
-# ---- stub sqlalchemy so `text()` & `Engine` exist ----
+# ---- stub sqlalchemy so `Engine` exists ----
 sqlalchemy_stub = types.ModuleType("sqlalchemy")
-sqlalchemy_stub.text = lambda s: s
+sqlalchemy_stub.Engine = object
 class DummyEngine:                       # prints every SQL executed
-    def begin(self):
+    def connect(self):
         class _Ctx:
             def __enter__(self): return self
             def __exit__(self,*a): pass
-            def execute(self, sql): print("⮕", sql, "\n")
+            def begin(self): return self
+            def exec_driver_sql(self, sql): print("⮕", sql, "\n")
         return _Ctx()
 sys.modules["sqlalchemy"] = sqlalchemy_stub
 
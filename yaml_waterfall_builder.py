@@ -1,120 +1,216 @@
 # yaml_waterfall_builder.py  (patched)
 # ---------------------------------------------------------------
 from __future__ import annotations
-import re, yaml, logging
+import itertools, re, yaml, logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List
-from sqlalchemy import Engine, text
+from string import Template
+from typing import Any, Dict, List, Tuple
+from sqlalchemy import Engine
 
-RE_OUTPUT = re.compile(r"^[A-Za-z_][\w$#]*\.[A-Za-z_][\w$#]*$")
+# libyaml-backed loader when PyYAML was built with it, pure Python otherwise
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+# unanchored: always applied with fullmatch
+RE_OUTPUT = re.compile(r"([A-Za-z_][\w$#]*)\.([A-Za-z_][\w$#]*)")   # schema, table
+_RE_IDENT = re.compile(r"[A-Za-z_][\w$#]*")
+_META_KEYS = frozenset(("settings", "tables"))    # every other top-level key is a channel
+
+MAX_DDL_WORKERS = 8                               # concurrent non-base channel DDLs
+
+# per-channel CTAS; the secondary index is declared in the same request
+_DDL_TEMPLATE = Template("""\
+CREATE MULTISET TABLE ${out_schema}.${offer_code}_${ch}_waterfall AS (
+            SELECT
+               ${select_list}
+            ${from_block}
+        ) WITH DATA
+        INDEX (${id_names})""")
 
 # ── helpers ────────────────────────────────────────────────────
 _comma   = lambda xs: ", ".join(xs)
-_is_id   = lambda s: re.match(r"^[A-Za-z_][\w$#]*$", s)
-_bare    = lambda s: s.split(".")[-1]          # strip a. → customer_id
+_is_id   = lambda s: _RE_IDENT.fullmatch(s) is not None
+_bare    = lambda s: s.rpartition(".")[2]      # strip a. → customer_id
 
-def _validate(doc: Dict[str, Any]) -> None:
+def _validate(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate the spec in one pass and return what the builder needs from it:
+    channels (base first), base_chk_aliases (base_<tmpl>_<n> per base
+    check) and parsed_outputs ({channel: (schema, table)})."""
     if "settings" not in doc or "tables" not in doc:
         raise ValueError("YAML must have top‑level 'settings' and 'tables'.")
-    chans = [k for k in doc if k not in ("settings", "tables")]
+    chans = [k for k in doc if k not in _META_KEYS]
     if not chans or chans[0] != "base":
         raise ValueError("First channel must be literally 'base'.")
+    outputs, base_chk_aliases, base_tmpl_ctr = {}, [], defaultdict(int)
     for ch in chans:
         if not _is_id(ch):
             raise ValueError(f"Illegal channel name {ch}")
-        if not RE_OUTPUT.match(doc[ch].get("output", "")):
+        m = RE_OUTPUT.fullmatch(doc[ch].get("output", ""))
+        if not m:
             raise ValueError(f"{ch}: output must be schema.table")
-        for ck in doc[ch].get("checks", []):
-            if not ck.get("teradata_logic"):
+        outputs[ch] = m.groups()
+        needs_tmpl = ch != "base"
+        for ck in doc[ch].get("checks") or ():
+            logic, tmpl, desc = ck.get("teradata_logic"), ck.get("template_id"), ck.get("description", "")
+            if not logic:
                 raise ValueError(f"{ch}: every check needs teradata_logic")
-            if ch != "base" and not ck.get("template_id"):
+            if needs_tmpl and not tmpl:
                 raise ValueError(f"{ch}: non‑base check missing template_id")
-            if not ck.get("description", "").strip():
+            if not desc.strip():
                 raise ValueError(f"{ch}: description cannot be empty")
-    if sum(j["join_type"].upper() == "FROM" for j in doc["tables"].values()) != 1:
+            if not needs_tmpl:
+                alias_tmpl = ck.get("template_id", "BA")
+                base_tmpl_ctr[alias_tmpl] += 1
+                base_chk_aliases.append(f"base_{alias_tmpl}_{base_tmpl_ctr[alias_tmpl]}")
+    from_count = 0                                 # stop at the second FROM
+    for j in doc["tables"].values():
+        if j["join_type"].upper() == "FROM":
+            from_count += 1
+            if from_count > 1:
+                break
+    if from_count != 1:
         raise ValueError("Exactly one table must have join_type FROM")
+    return {"channels": chans, "base_chk_aliases": base_chk_aliases, "parsed_outputs": outputs}
+
+@lru_cache(maxsize=64)
+def _load_yaml(path: str, mtime_ns: int) -> Dict[str, Any]:
+    """Parsed spec; mtime_ns is part of the key, so an edited file is re-read.
+    The result is shared between calls and must not be mutated."""
+    with open(path, "rb") as fh:                   # the loader reads the bytes itself
+        return yaml.load(fh, Loader=_YamlLoader)
+
+# ── settings lookup across many specs ──────────────────────────
+_PEEK_LINES = 50                                   # settings sit at the top
+
+def _settings_of(stream) -> Tuple[Any, bool]:
+    """(settings, closed): closed when another top-level key follows settings,
+    i.e. the settings block ends inside the parsed text."""
+    try:
+        top = yaml.load(stream, Loader=_YamlLoader)
+    except yaml.YAMLError:                         # unparsable: no settings
+        return None, False
+    if not isinstance(top, dict) or "settings" not in top:
+        return None, False
+    return top["settings"], list(top)[-1] != "settings"
+
+@lru_cache(maxsize=64)
+def _peek_offer_code(path: str, mtime_ns: int) -> Any:
+    """settings.offer_code of a spec, parsing only its first lines when they hold it.
+
+    The head is trusted only when the settings block is closed inside it (a
+    later top-level key, or the head is the whole file), so a value cut at the
+    last peeked line is never returned; otherwise the whole file is parsed.
+    A file that does not parse at all has no offer code (None)."""
+    with open(path, "rb") as fh:
+        head = b"".join(itertools.islice(fh, _PEEK_LINES))
+        at_eof = not fh.read(1)
+    settings, closed = _settings_of(head)
+    if not (isinstance(settings, dict) and "offer_code" in settings and (closed or at_eof)):
+        with open(path, "rb") as fh:
+            settings, _ = _settings_of(fh)
+    return settings.get("offer_code") if isinstance(settings, dict) else None
+
+def find_waterfall_yaml(directory: str | Path, offer_code: str) -> Path | None:
+    """First *.yaml / *.yml spec in directory whose settings.offer_code matches."""
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix not in (".yaml", ".yml") or not path.is_file():
+            continue
+        p = path.resolve()
+        if _peek_offer_code(str(p), p.stat().st_mtime_ns) == offer_code:
+            return path
+    return None
 
 # ── main builder ───────────────────────────────────────────────
 def build_waterfall_tables(engine: Engine,
                            yaml_path: str | Path,
                            logger: logging.Logger) -> List[str]:
-    doc = yaml.safe_load(Path(yaml_path).read_text())
-    _validate(doc)
+    spec    = Path(yaml_path).resolve()
+    doc     = _load_yaml(str(spec), spec.stat().st_mtime_ns)
+    artifacts = _validate(doc)
+    channels, outputs = artifacts["channels"], artifacts["parsed_outputs"]
 
     settings      = doc["settings"]
     id_cols       = settings["count_columns"]        # may include aliases
     offer_code    = settings["offer_code"]
-    ddl_ran: List[str] = []
 
     # ---- 1.  keep table order exactly as in YAML -----------------
     tables_items  = list(doc["tables"].items())
     base_tbl_key, base_tbl_info = next((k, v) for k, v in tables_items
                                        if v["join_type"].upper() == "FROM")
     first_alias   = base_tbl_info["alias"]            # e.g. a
+    id_names      = [_bare(c) for c in id_cols]        # e.g. customer_id
+    id_names_csv  = _comma(id_names)
 
-    # ---- 2.  pre‑compute base‑check aliases ----------------------
-    base_chk_aliases, per_tmpl_ctr = [], {}
-    for ck in doc["base"]["checks"]:
-        tmpl = ck.get("template_id", "BA")
-        per_tmpl_ctr[tmpl] = per_tmpl_ctr.get(tmpl, 0) + 1
-        base_chk_aliases.append(f"base_{tmpl}_{per_tmpl_ctr[tmpl]}")
+    # ---- 2.  base-check aliases (computed while validating) -----
+    base_chk_aliases = artifacts["base_chk_aliases"]
 
-    # ---- 3.  iterate over channels (base first) ------------------
-    for ch in [k for k in doc if k not in ("settings", "tables")]:
+    # every non-base channel joins the same filter on base's results
+    base_wf   = "".join([
+        "SELECT ", id_names_csv,
+        f" FROM user_work.{offer_code}_base_waterfall ",
+        "WHERE ", " AND ".join(f"{c}=1" for c in base_chk_aliases),
+    ])
+    join_keys = " AND ".join(
+        f"{first_alias}.{name} = base_wf.{name}" for name in id_names
+    )
+    base_wf_join = f"INNER JOIN ({base_wf}) base_wf ON {join_keys}"
+
+    # FROM/JOIN blocks as clause lists: the FROM table, for non-base channels
+    # the filter join, then the remaining tables in YAML order (the FROM
+    # table is skipped, it is already emitted). Only two variants exist.
+    join_lines = [
+        f"{meta['join_type'].upper()} {key} {meta['alias']} ON {meta['join_logic']}"
+        for key, meta in tables_items if key != base_tbl_key
+    ]
+    from_head        = f"FROM {base_tbl_key} {first_alias}"
+    base_from_block  = "\n    ".join([from_head, *join_lines])
+    chan_from_block  = "\n    ".join([from_head, base_wf_join, *join_lines])
+
+    # ---- 3.  render every channel's DDL (base first) -------------
+    jobs: List[Tuple[str, str]] = []                 # (table, ddl)
+    for ch in channels:
         info            = doc[ch]
-        out_schema, _   = info["output"].split(".")
+        out_schema, _   = outputs[ch]               # already split by _validate
         # ---- select list ----------------------------------------
-        sel_cols   = _comma(id_cols)
-        tmpl_ctr   = {}
-        sel_checks = []
+        tmpl_ctr   = defaultdict(int)
+        sel_items  = [_comma(id_cols)]                       # id cols, then checks
         for ck in info["checks"]:
             tmpl = ck.get("template_id", "BA")
-            tmpl_ctr[tmpl] = tmpl_ctr.get(tmpl, 0) + 1
+            tmpl_ctr[tmpl] += 1
             alias = f"{ch}_{tmpl}_{tmpl_ctr[tmpl]}"
-            sel_checks.append(
+            sel_items.append(
                 f"CASE WHEN {ck['teradata_logic']} THEN 1 ELSE 0 END AS {alias}"
             )
-        select_list = ",\n               ".join([sel_cols, *sel_checks])
-
-        # ---- FROM/JOIN block ------------------------------------
-        lines = [f"FROM {base_tbl_key} {first_alias}"]
-        if ch != "base":                                     # add the filter join
-            id_names  = [_bare(c) for c in id_cols]
-            base_wf   = (
-                "SELECT " + _comma(id_names) +
-                f" FROM user_work.{offer_code}_base_waterfall " +
-                "WHERE " + " AND ".join(f"{c}=1" for c in base_chk_aliases)
-            )
-            join_keys = " AND ".join(
-                f"{first_alias}.{name} = base_wf.{name}" for name in id_names
-            )
-            lines.append(f"INNER JOIN ({base_wf}) base_wf ON {join_keys}")
-
-        # remaining tables (skip the FROM table already used)
-        for key, meta in tables_items:
-            if key == base_tbl_key:           # already emitted
-                continue
-            jt   = meta["join_type"].upper()
-            ali  = meta["alias"]
-            oncl = meta["join_logic"]
-            lines.append(f"{jt} {key} {ali} ON {oncl}")
+        select_list = ",\n               ".join(sel_items)
 
-        from_block = "\n    ".join(lines)
+        # ---- FROM/JOIN block (filter join for non-base) --------
+        from_block = base_from_block if ch == "base" else chan_from_block
 
         # ---- full DDL -------------------------------------------
-        ddl = f"""CREATE MULTISET TABLE {out_schema}.{offer_code}_{ch}_waterfall AS (
-            SELECT
-               {select_list}
-            {from_block}
-        ) WITH DATA"""
-        idx = f"CREATE INDEX ({_comma([_bare(c) for c in id_cols])}) " \
-              f"ON {out_schema}.{offer_code}_{ch}_waterfall"
-
-        with engine.begin() as cx:
-            cx.execute(text(ddl))
-            cx.execute(text(idx))
-        logger.info("Created %s.%s",
-                    out_schema, f"{offer_code}_{ch}_waterfall")
-        ddl_ran += [ddl, idx]
-
-    return ddl_ran
+        ddl = _DDL_TEMPLATE.substitute(
+            out_schema=out_schema, offer_code=offer_code, ch=ch,
+            select_list=select_list, from_block=from_block, id_names=id_names_csv,
+        )
+        jobs.append((f"{out_schema}.{offer_code}_{ch}_waterfall", ddl))
+
+    # ---- 4.  execute: base, then the rest concurrently -----------
+    #          non-base channels only read base's table and each writes
+    #          its own, so they run in parallel, one pooled connection
+    #          and one transaction per channel
+    def _create(table: str, ddl: str) -> None:
+        with engine.connect() as conn, conn.begin():   # no binds: skip text()
+            conn.exec_driver_sql(ddl)
+        logger.info("Created %s", table)
+
+    _create(*jobs[0])
+    if len(jobs) > 1:
+        with ThreadPoolExecutor(max_workers=min(len(jobs) - 1, MAX_DDL_WORKERS)) as pool:
+            for fut in [pool.submit(_create, *job) for job in jobs[1:]]:
+                fut.result()                     # re-raise the first failure
+
+    return [ddl for _, ddl in jobs]